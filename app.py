@@ -1,4 +1,9 @@
+import csv
+import json
+import os
+import threading
 import streamlit as st
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from pathlib import Path
@@ -6,80 +11,157 @@ from pathlib import Path
 # ---- CONFIG ----
 CONFIG_PATH = "game_config.csv"
 SUBMISSIONS_PATH = "submissions.csv"
+LEADERBOARD_PATH = "leaderboard.json"
 STOCKS = ["CEN", "FBU", "AIR", "FPH", "WHS"]
+ACTIONS = ("Buy", "Sell", "Hold")
+SELECT_KEYS = tuple(f"select_{s}" for s in STOCKS)
+SIGN_MAP = {"Buy": 1, "Sell": -1, "Hold": 0}
+_STOCKS_SET = frozenset(STOCKS)
+_REQ_COLS = frozenset({"round", "headline"}) | _STOCKS_SET
+FIELDNAMES = [
+    "timestamp", "participant", "round", "headline",
+    *[f"choice_{s}" for s in STOCKS],
+    *[f"return_{s}" for s in STOCKS],
+    "round_score", "cum_score_after",
+]
 
 # ---- HELPERS ----
-@st.cache_data
-def load_config(path: str) -> pd.DataFrame:
+@st.cache_resource(max_entries=1)
+def load_config(path: str, mtime: float) -> pd.DataFrame:
     df = pd.read_csv(path)
-    req_cols = {"round", "headline"} | set(STOCKS)
-    missing = req_cols - set(df.columns)
+    missing = _REQ_COLS - set(df.columns)
     if missing:
-        raise ValueError(f"Config missing columns: {missing}")
-    return df.sort_values("round").reset_index(drop=True)
+        raise ValueError(f"Config missing columns: {set(missing)}")
+    df = df.sort_values("round").reset_index(drop=True)
+    # column layout for the hot paths: (returns[round, stock], headlines, round numbers)
+    df.attrs["arrays"] = (
+        df[STOCKS].to_numpy(dtype=np.float64),
+        df["headline"].tolist(),
+        df["round"].to_numpy(dtype=np.int32),
+    )
+    return df
 
 def init_state(cfg: pd.DataFrame):
     if "cfg" not in st.session_state: st.session_state.cfg = cfg
     if "round_idx" not in st.session_state: st.session_state.round_idx = 0
     if "choices" not in st.session_state: st.session_state.choices = {}
     if "scores" not in st.session_state: st.session_state.scores = []
+    if "scoreboard" not in st.session_state: st.session_state.scoreboard = []
     if "participant" not in st.session_state: st.session_state.participant = ""
     if "locked_rounds" not in st.session_state: st.session_state.locked_rounds = set()
 
-def action_to_sign(action: str) -> int:
-    return {"Buy": 1, "Sell": -1, "Hold": 0}[action]
-
 def calc_round_score(cfg: pd.DataFrame, r_idx: int, choices: dict) -> float:
-    row = cfg.iloc[r_idx]
-    return sum(action_to_sign(choices.get(s, "Hold")) * float(row[s]) for s in STOCKS)
+    signs = np.fromiter((SIGN_MAP[choices.get(s, "Hold")] for s in STOCKS), dtype=np.int8, count=len(STOCKS))
+    returns_arr, _, _ = cfg.attrs["arrays"]
+    return float(signs @ returns_arr[r_idx])
 
-def save_submission(cfg: pd.DataFrame, r_idx: int, score: float, participant: str, choices: dict):
-    row = cfg.iloc[r_idx]
+def save_submission(cfg: pd.DataFrame, r_idx: int, score: float, participant: str, choices: dict) -> float:
+    returns_arr, headlines, round_numbers = cfg.attrs["arrays"]
     ts = datetime.now().isoformat(timespec="seconds")
-    data = {
-        "timestamp": ts,
-        "participant": participant,
-        "round": int(row["round"]),
-        "headline": row["headline"],
-        **{f"choice_{s}": choices.get(s, "Hold") for s in STOCKS},
-        **{f"return_{s}": float(row[s]) for s in STOCKS},
-        "round_score": score,
-    }
-    try:
-        df = pd.read_csv(SUBMISSIONS_PATH)
-        df = pd.concat([df, pd.DataFrame([data])], ignore_index=True)
-    except Exception:
-        df = pd.DataFrame([data])
-    df["cum_score_after"] = df.groupby("participant")["round_score"].cumsum()
-    df.to_csv(SUBMISSIONS_PATH, index=False)
+    # the snapshot holds the shared running totals, so both files are updated under one lock
+    with _board_lock():
+        board = load_board()
+        cum_score = board.get(participant, {}).get("cum_score", 0.0) + score
+        data = {
+            "timestamp": ts,
+            "participant": participant,
+            "round": int(round_numbers[r_idx]),
+            "headline": headlines[r_idx],
+            **{f"choice_{s}": choices.get(s, "Hold") for s in STOCKS},
+            **{f"return_{s}": float(returns_arr[r_idx, j]) for j, s in enumerate(STOCKS)},
+            "round_score": score,
+            "cum_score_after": cum_score,
+        }
+        # append only the new row; the header is written when the file is first created
+        new_file = not Path(SUBMISSIONS_PATH).exists()
+        with open(SUBMISSIONS_PATH, "a", newline="", buffering=1 << 16) as f:
+            w = csv.DictWriter(f, FIELDNAMES)
+            if new_file: w.writeheader()
+            w.writerow(data)
+        _load_submissions_cached.clear()
+        board[participant] = {"latest_round": data["round"], "latest_score": score, "cum_score": cum_score}
+        write_board(board)
+    return cum_score
+
+@st.cache_data(show_spinner=False)
+def _load_submissions_cached(path: str, mtime: float) -> pd.DataFrame:
+    # mtime is only part of the cache key: any write to the file busts the cache;
+    # names stay strings so "007" matches the key save_submission uses in the snapshot
+    return pd.read_csv(path, dtype={"participant": str})
 
 def load_submissions() -> pd.DataFrame:
-    if not Path(SUBMISSIONS_PATH).exists(): return pd.DataFrame()
-    return pd.read_csv(SUBMISSIONS_PATH)
-
-def compute_leaderboard(sub: pd.DataFrame) -> pd.DataFrame:
-    if sub.empty: return pd.DataFrame(columns=["participant","latest_round","latest_score","cum_score"])
-    latest = sub.sort_values(["participant","timestamp"]).groupby("participant").tail(1)
-    board = latest[["participant","round","cum_score_after"]].rename(
-        columns={"round":"latest_round","cum_score_after":"cum_score"}
-    )
-    last_scores = latest[["participant","round_score"]].rename(columns={"round_score":"latest_score"})
-    board = board.merge(last_scores, on="participant")
-    return board.sort_values("cum_score", ascending=False).reset_index(drop=True)
+    path = Path(SUBMISSIONS_PATH)
+    if not path.exists(): return pd.DataFrame()
+    return _load_submissions_cached(SUBMISSIONS_PATH, path.stat().st_mtime)
+
+def board_from_history(sub: pd.DataFrame) -> dict:
+    if sub.empty: return {}
+    sub = sub.sort_values(["participant","timestamp"])
+    # rescore every logged row in one pass: sign matrix (Buy=+1, Sell=-1, Hold=0) times returns, row-wise
+    choices = sub[[f"choice_{s}" for s in STOCKS]].to_numpy()
+    signs = np.where(choices == "Buy", 1, np.where(choices == "Sell", -1, 0)).astype(np.int8)
+    returns = sub[[f"return_{s}" for s in STOCKS]].to_numpy(dtype=np.float64)
+    sub["round_score"] = np.einsum("ij,ij->i", signs, returns)
+    sub["cum_score_after"] = sub.groupby("participant")["round_score"].cumsum()
+    latest = sub.drop_duplicates("participant", keep="last")
+    return {
+        p: {"latest_round": int(r), "latest_score": float(ls), "cum_score": float(c)}
+        for p, r, ls, c in zip(latest["participant"], latest["round"], latest["round_score"], latest["cum_score_after"])
+    }
+
+def _log_stamp():
+    # mtime and size of the log, or None if it doesn't exist; the snapshot is only trusted while these match
+    path = Path(SUBMISSIONS_PATH)
+    if not path.exists(): return None
+    stat = path.stat()
+    return [stat.st_mtime, stat.st_size]
+
+def _read_snapshot():
+    if not Path(LEADERBOARD_PATH).exists(): return None
+    with open(LEADERBOARD_PATH) as f:
+        snap = json.load(f)
+    if "participants" not in snap or snap.get("log") != _log_stamp(): return None
+    return snap["participants"]
+
+def load_board() -> dict:
+    board = _read_snapshot()
+    if board is not None: return board
+    # snapshot missing, from an older version, or out of step with the log (deleted or edited by hand): rebuild it
+    with _board_lock():
+        board = _read_snapshot()
+        if board is None:
+            board = board_from_history(load_submissions())
+            write_board(board)
+        return board
+
+def write_board(board: dict):
+    tmp = LEADERBOARD_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"log": _log_stamp(), "participants": board}, f)
+    os.replace(tmp, LEADERBOARD_PATH)
+
+@st.cache_resource
+def _board_lock() -> threading.RLock:
+    # re-entrant: save_submission holds it while load_board may rebuild the snapshot
+    return threading.RLock()
+
+def compute_leaderboard() -> pd.DataFrame:
+    board = load_board()
+    rows = [{"participant": p, **v} for p, v in board.items()]
+    rows.sort(key=lambda r: r["cum_score"], reverse=True)
+    return pd.DataFrame(rows, columns=["participant","latest_round","cum_score","latest_score"])
 
 # ---- APP ----
 st.set_page_config(page_title="Trading Room Game", page_icon="📈", layout="wide")
-cfg = load_config(CONFIG_PATH)
 
 # Check for spectator mode
 params = st.query_params
-spectator_mode = str(params.get("mode", [""])[0]).lower() in {"spectator","leaderboard"}
+spectator_mode = str(params.get("mode", "")).lower() in {"spectator","leaderboard"}
 
 if spectator_mode:
     st.title("🏆 Live Leaderboard (Spectator Mode)")
     st.caption("🔄 Refresh the page (Ctrl+R / Cmd+R) to update the leaderboard.")
-    sub = load_submissions()
-    board = compute_leaderboard(sub)
+    board = compute_leaderboard()
     if board.empty:
         st.info("No submissions yet.")
     else:
@@ -91,6 +173,9 @@ if spectator_mode:
         }), hide_index=True, use_container_width=True)
         st.bar_chart(board.set_index("participant")["cum_score"])
 else:
+    cfg = load_config(CONFIG_PATH, Path(CONFIG_PATH).stat().st_mtime)
+    _, headlines, round_numbers = cfg.attrs["arrays"]
+
     tabs = st.tabs(["🎮 Play","🏆 Leaderboard","⚙️ Admin"])
 
     # --- Play tab ---
@@ -101,36 +186,45 @@ else:
         with st.sidebar:
             st.text_input("Participant name", key="participant", placeholder="Team A")
             if st.button("Reset current player"):
-                for k in ["round_idx","choices","scores","locked_rounds"]: st.session_state[k] = {} if k=="choices" else [] if k=="scores" else 0 if k=="round_idx" else set()
+                for k in ["round_idx","choices","scores","scoreboard","locked_rounds"]: st.session_state[k] = {} if k=="choices" else [] if k in ("scores","scoreboard") else 0 if k=="round_idx" else set()
+                st.session_state.pop("select_round", None)
 
         if not st.session_state.participant: st.stop()
         r_idx = st.session_state.round_idx
-        row = cfg.iloc[r_idx]
-        st.subheader(f"Round {int(row['round'])}")
-        st.write(f"**Headline:** {row['headline']}")
+        round_no = int(round_numbers[r_idx])
+        st.subheader(f"Round {round_no}")
+        st.write(f"**Headline:** {headlines[r_idx]}")
 
         locked = r_idx in st.session_state.locked_rounds
+        # selectboxes keep one key per stock; load this round's choices into them when the round changes
+        resync = st.session_state.get("select_round") != r_idx
+        round_choices = st.session_state.choices.get(r_idx,{})
+        for s,k in zip(STOCKS,SELECT_KEYS):
+            if resync or k not in st.session_state:
+                st.session_state[k] = round_choices.get(s,"Hold")
+        st.session_state.select_round = r_idx
         cols = st.columns(3)
-        for i,s in enumerate(STOCKS):
-            default = st.session_state.choices.get(r_idx,{}).get(s,"Hold")
+        for i,(s,k) in enumerate(zip(STOCKS,SELECT_KEYS)):
             with cols[i%3]:
-                st.selectbox(f"{s} action",["Buy","Sell","Hold"],
-                    index=["Buy","Sell","Hold"].index(default),disabled=locked,key=f"{r_idx}_{s}")
+                st.selectbox(f"{s} action",ACTIONS,disabled=locked,key=k)
 
         if not locked and st.button("Submit choices",type="primary"):
-            st.session_state.choices[r_idx] = {s:st.session_state[f"{r_idx}_{s}"] for s in STOCKS}
+            st.session_state.choices[r_idx] = {s:st.session_state[k] for s,k in zip(STOCKS,SELECT_KEYS)}
             score = calc_round_score(cfg,r_idx,st.session_state.choices[r_idx])
             st.session_state.scores.append(score)
             st.session_state.locked_rounds.add(r_idx)
-            save_submission(cfg,r_idx,score,st.session_state.participant,st.session_state.choices[r_idx])
-            st.success(f"Round {row['round']} submitted. Score {score:+.1f}")
+            cum_score = save_submission(cfg,r_idx,score,st.session_state.participant,st.session_state.choices[r_idx])
+            st.session_state.scoreboard.append({"Round": round_no, "Round score": score, "Cumulative score": cum_score})
+            st.success(f"Round {round_no} submitted. Score {score:+.1f}")
+
+        if st.session_state.scoreboard:
+            st.table(st.session_state.scoreboard)
 
     # --- Leaderboard tab ---
     with tabs[1]:
         st.title("🏆 Live Leaderboard")
         st.caption("🔄 Refresh the page (Ctrl+R / Cmd+R) to update the leaderboard.")
-        sub = load_submissions()
-        board = compute_leaderboard(sub)
+        board = compute_leaderboard()
         if board.empty:
             st.info("No submissions yet.")
         else:
@@ -146,5 +240,9 @@ else:
     with tabs[2]:
         st.write("⚙️ Admin tools here")
         if st.button("Clear submissions.csv"):
-            Path(SUBMISSIONS_PATH).unlink(missing_ok=True)
+            # hold the board lock so a clear can't land between a submit's append and its snapshot write
+            with _board_lock():
+                Path(SUBMISSIONS_PATH).unlink(missing_ok=True)
+                Path(LEADERBOARD_PATH).unlink(missing_ok=True)
+                _load_submissions_cached.clear()
             st.success("Cleared.")